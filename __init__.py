@@ -20,11 +20,14 @@
 #         discovery_prefix: "homeassistant"
 #         margin_seconds: 300          # or use margin_factor: 0.15 (15%)
 #         min_power_w: 0               # minimum floor when power > 0; 0 disables
+#         debounce_seconds: 0.5        # drop unchanged repeat messages inside this window; 0 disables
+#         batch_seconds: 0.05          # coalesce outgoing publishes into one flush; 0 disables
 #         enable_comp_fallback: false  # publish comp-based estimates between ticks
 #         log_level: "info"            # or "debug"
 
-from datetime import datetime, timezone
 import json
+import time
+from functools import lru_cache
 
 # ----------------------- App configuration -----------------------
 cfg = pyscript.app_config or {}
@@ -33,30 +36,102 @@ DISCOVERY_PREFIX       = cfg.get("discovery_prefix",      "homeassistant")
 MARGIN_SECONDS_DEFAULT = float(cfg.get("margin_seconds",  300))  # used if margin_factor is not set
 MARGIN_FACTOR          = cfg.get("margin_factor",         0.5)  # e.g. 0.5 means +50% of last Δt
 MIN_POWER_W            = float(cfg.get("min_power_w",     0))
+DEBOUNCE_S             = float(cfg.get("debounce_seconds", 0.5))  # drop unchanged repeats inside this window; 0 disables
+BATCH_SECONDS          = float(cfg.get("batch_seconds",   0.05))  # coalesce outgoing publishes into one flush; 0 disables
 ENABLE_COMP_FALLBACK   = bool(cfg.get("enable_comp_fallback", False))
 LOG_LEVEL              = str(cfg.get("log_level", "info")).lower()
 
-def _log_debug(msg): 
-    if LOG_LEVEL == "debug":
-        log.debug(msg)
-def _log_info(msg): 
-    if LOG_LEVEL in ("info", "debug", ""):
-        log.info(msg)
+# Parse margin_factor once; a bad value falls back to additive margin_seconds
+try:
+    _MARGIN_FACTOR = float(MARGIN_FACTOR) if MARGIN_FACTOR is not None else None
+except (TypeError, ValueError):
+    _MARGIN_FACTOR = None
+
+# Precomputed once so hot paths can guard before building the f-string
+_DEBUG = LOG_LEVEL == "debug"
+_INFO  = LOG_LEVEL in ("info", "debug", "")
+
+# Bind per-message callables once; saves a global + attribute lookup per call
+_mqtt_publish = mqtt.publish
+_debug_log    = log.debug
+_info_log     = log.info
+
+def _log_debug(msg):
+    if _DEBUG:
+        _debug_log(msg)
+def _log_info(msg):
+    if _INFO:
+        _info_log(msg)
 
 # ----------------------- Internal state --------------------------
-# Per-unit rolling state
-# unit -> dict(last_wh:int, last_ts:float, hold_until:float, last_w:float, discovered:bool, dev_id:str)
+class UnitState:
+    """Per-unit rolling state; slotted so hot-path attribute access stays cheap."""
+    __slots__ = (
+        "last_wh", "last_ts", "hold_until", "last_w", "dev_id",
+        "last_seen_wh", "last_msg_ts", "last_seen_comp", "last_comp_ts",
+        "last_w_published", "state_topic", "config_url",
+    )
+
+    def __init__(self, unit: str):
+        self.state_topic = f"faikin/{unit}/power_w"
+        self.config_url = f"http://{unit}.local/"
+        self.last_wh = None
+        self.last_ts = None
+        self.hold_until = 0.0
+        self.last_w = 0.0
+        self.dev_id = None
+        self.last_seen_wh = None
+        self.last_msg_ts = 0.0
+        self.last_seen_comp = None
+        self.last_comp_ts = 0.0
+        self.last_w_published = None
+
+# unit -> UnitState
 _units = {}
 
-# ----------------------- MQTT Discovery --------------------------
-def _discovery(unit: str, dev_id: str, config_url: str | None = None):
-    """Publish MQTT Discovery for the unit's estimated power sensor."""
-    rec = _units.setdefault(unit, {})
-    if rec.get("discovered"):
+def _get(unit: str) -> UnitState:
+    """Resolve the unit's state record, creating it on first sight."""
+    st = _units.get(unit)
+    if st is None:
+        st = UnitState(unit)
+        _units[unit] = st
+    return st
+
+# ----------------------- Batched MQTT publish --------------------
+# Publishes from one burst (several units ticking together, reload-time
+# discovery) are queued and flushed by a single task instead of issuing
+# a broker write per call. Later writes to the same topic overwrite the
+# queued payload, so only the freshest value per topic goes out.
+_pending = {}          # topic -> (payload, qos, retain)
+_flush_scheduled = False
+
+def _enqueue(topic: str, payload: str, qos: int, retain: bool):
+    """Queue a publish; a single flush task drains the queue after BATCH_SECONDS."""
+    global _flush_scheduled
+    if BATCH_SECONDS <= 0:
+        _mqtt_publish(topic=topic, payload=payload, qos=qos, retain=retain)
         return
+    _pending[topic] = (payload, qos, retain)
+    if not _flush_scheduled:
+        _flush_scheduled = True
+        task.create(_flush)
 
-    object_id   = f"{unit}_power"  # simple object_id prevents doubled names
-    cfg_topic   = f"{DISCOVERY_PREFIX}/sensor/{object_id}/config"
+def _flush():
+    global _flush_scheduled
+    task.sleep(BATCH_SECONDS)
+    _flush_scheduled = False
+    batch = list(_pending.items())
+    _pending.clear()
+    for topic, (payload, qos, retain) in batch:
+        _mqtt_publish(topic=topic, payload=payload, qos=qos, retain=retain)
+
+# ----------------------- MQTT Discovery --------------------------
+@pyscript_compile
+@lru_cache(maxsize=64)
+def _discovery_payload(unit: str, dev_id: str, config_url: str | None) -> str:
+    """Build the (fully static per unit) discovery JSON; compiled native so
+    lru_cache memoizes the string (a Pyscript-interpreted function would hand
+    the cache a coroutine), and repeat builds skip dict build + JSON encoding."""
     state_topic = f"faikin/{unit}/power_w"
 
     device = {
@@ -85,9 +160,25 @@ def _discovery(unit: str, dev_id: str, config_url: str | None = None):
 
         "device": device,
     }
-    mqtt.publish(topic=cfg_topic, payload=json.dumps(payload), qos=1, retain=True)
-    rec["discovered"] = True
-    _units[unit] = rec
+    return json.dumps(payload)
+
+# Units whose discovery config has been published in this process
+_discovered = set()
+
+def _discovery(unit: str, dev_id: str, config_url: str | None = None):
+    """Publish MQTT Discovery for the unit's estimated power sensor."""
+    if unit in _discovered:
+        return
+
+    st = _get(unit)
+    if config_url is None:
+        config_url = st.config_url
+    object_id = f"{unit}_power"  # simple object_id prevents doubled names
+    cfg_topic = f"{DISCOVERY_PREFIX}/sensor/{object_id}/config"
+    # QoS 0 avoids the PUBACK round-trip; retain still delivers the config to HA on subscribe
+    _enqueue(cfg_topic, _discovery_payload(unit, dev_id, config_url), qos=0, retain=True)
+    _discovered.add(unit)
+    st.dev_id = dev_id
     _log_info(f"[faikin_power] discovery published for unit={unit} device_id={dev_id}")
     _log_info(f"[faikin_power] discovery topic: {cfg_topic}")
 
@@ -97,21 +188,28 @@ def _publish_power(unit: str, watts: float):
         watts = 0.0
     if MIN_POWER_W and watts > 0:
         watts = max(watts, MIN_POWER_W)
-    mqtt.publish(topic=f"faikin/{unit}/power_w", payload=str(round(float(watts), 1)), qos=0, retain=True)
-    _units.setdefault(unit, {})["last_w"] = float(watts)
-    _log_debug(f"[faikin_power] publish {unit}: {watts:.1f} W")
-
-def _compute_hold_seconds(last_dt_seconds: float) -> float:
-    """Hold window per pydaikin behavior: last Δt plus either a timedelta-like margin, or a factor."""
-    if MARGIN_FACTOR is not None:
-        try:
-            fac = float(MARGIN_FACTOR)
-            return max(0.0, last_dt_seconds * (1.0 + fac))
-        except Exception:
-            pass
-    # fallback: additive seconds
+    st = _get(unit)
+    payload = f"{watts:.1f}"  # C-level formatting; rounds to the published 0.1 W precision
+    # Broker already holds the retained value — skip no-op republishes (common at 0 W)
+    if payload == st.last_w_published:
+        return
+    _enqueue(st.state_topic, payload, qos=0, retain=True)
+    st.last_w_published = payload
+    st.last_w = float(watts)
+    if _DEBUG:
+        _debug_log(f"[faikin_power] publish {unit}: {payload} W")
+
+# Hold window per pydaikin behavior: last Δt plus either a factor of Δt or
+# additive margin seconds. The choice is fixed at load time, so bind the
+# matching variant once instead of re-branching on every tick.
+def _hold_seconds_factor(last_dt_seconds: float) -> float:
+    return max(0.0, last_dt_seconds * (1.0 + _MARGIN_FACTOR))
+
+def _hold_seconds_additive(last_dt_seconds: float) -> float:
     return max(0.0, last_dt_seconds + MARGIN_SECONDS_DEFAULT)
 
+_compute_hold_seconds = _hold_seconds_factor if _MARGIN_FACTOR is not None else _hold_seconds_additive
+
 # ----------------------- Energy-derived power (pydaikin-style) ---
 def _update_from_energy(unit: str, wh_now: int, ts_now: float):
     """
@@ -121,52 +219,75 @@ def _update_from_energy(unit: str, wh_now: int, ts_now: float):
       - Keep that value valid until hold_until = ts_now + Δt + margin
       - After hold_until, publish 0 W
     """
-    rec = _units.setdefault(unit, {})
-    last_wh = rec.get("last_wh")
-    last_ts = rec.get("last_ts")
+    st = _get(unit)
+    last_wh = st.last_wh
+    last_ts = st.last_ts
 
     # First observation — initialise & publish 0 (so entity shows up cleanly)
     if last_wh is None or last_ts is None:
-        rec["last_wh"] = int(wh_now)
-        rec["last_ts"] = float(ts_now)
-        rec["hold_until"] = 0.0
-        _units[unit] = rec
+        st.last_wh = int(wh_now)
+        st.last_ts = float(ts_now)
+        st.hold_until = 0.0
         _publish_power(unit, 0.0)
         return
 
     # Counter reset/rollback
     if wh_now < last_wh:
-        rec["last_wh"] = int(wh_now)
-        rec["last_ts"] = float(ts_now)
-        rec["hold_until"] = 0.0
-        _units[unit] = rec
+        st.last_wh = int(wh_now)
+        st.last_ts = float(ts_now)
+        st.hold_until = 0.0
         _publish_power(unit, 0.0)
         return
 
-    # No change, but we may need to expire to 0 if the hold window passed
+    # No change — faikin_expire_hold drops us to 0 W once the hold window passes
     if wh_now == last_wh:
-        hold_until = rec.get("hold_until", 0.0)
-        if hold_until and ts_now > hold_until:
-            _publish_power(unit, 0.0)
-            rec["hold_until"] = 0.0
-            _units[unit] = rec
         return
 
     # We have a tick: compute power from ΔWh / Δt
-    dwh = float(wh_now - last_wh)
-    dt  = max(0.5, float(ts_now - last_ts))  # guard tiny intervals
-    watts = (dwh * 3600.0) / dt
+    dt = max(0.5, ts_now - last_ts)  # guard tiny intervals
+    watts = (wh_now - last_wh) * 3600 / dt
 
     # Update last_* and hold window per last Δt + margin
-    rec["last_wh"] = int(wh_now)
-    rec["last_ts"] = float(ts_now)
-    hold_seconds   = _compute_hold_seconds(dt)
-    rec["hold_until"] = ts_now + hold_seconds
-    _units[unit] = rec
+    st.last_wh = int(wh_now)
+    st.last_ts = float(ts_now)
+    st.hold_until = ts_now + _compute_hold_seconds(dt)
+    _note_hold(st.hold_until)
 
     # Publish estimated power now; it will expire to 0 after hold window
     _publish_power(unit, watts)
 
+# ----------------------- Hold-window expiry ----------------------
+# One periodic scan drops a unit to 0 W once its hold window elapses —
+# even if the device has gone silent — instead of re-checking hold_until
+# on every incoming message. _next_expiry tracks the soonest pending
+# window so the scan is a single comparison while all holds are live,
+# regardless of how many units exist.
+_next_expiry = float("inf")
+
+def _note_hold(hold_until: float):
+    global _next_expiry
+    if hold_until < _next_expiry:
+        _next_expiry = hold_until
+
+@time_trigger("period(now, 30sec)")
+def faikin_expire_hold():
+    global _next_expiry
+    now = time.time()
+    if now < _next_expiry:
+        return
+    nxt = float("inf")
+    for unit, st in _units.items():
+        hold_until = st.hold_until
+        if not hold_until:
+            continue
+        if now > hold_until:
+            st.hold_until = 0.0
+            if st.last_w != 0.0:
+                _publish_power(unit, 0.0)
+        elif hold_until < nxt:
+            nxt = hold_until
+    _next_expiry = nxt
+
 # ----------------------- Compressor fallback (optional) ----------
 def estimate_power_from_comp(comp_hz: float, fanfreq: float | None = None) -> float:
     """
@@ -178,50 +299,74 @@ def estimate_power_from_comp(comp_hz: float, fanfreq: float | None = None) -> fl
     # Simple placeholder: ~50 W per 'comp' unit. Tune if you enable this path.
     return max(0.0, float(comp_hz) * 50.0)
 
-# ----------------------- MQTT subscriptions (direct) -------------
-# Energy tick handler — only runs when payload contains 'Wh'
-@mqtt_trigger(f"{STATUS_PREFIX}/+", "payload_obj and ('Wh' in payload_obj)")
-def faikin_energy_tick(topic=None, payload_obj=None, **kwargs):
+# ----------------------- MQTT subscription (direct) --------------
+# Single wildcard trigger for both the energy tick and the comp fallback;
+# two separate subscriptions on the same topic would make Pyscript parse
+# and dispatch every state/<unit> message twice.
+# With the fallback disabled (the default), the filter only matches 'Wh'
+# payloads, so comp/fanfreq-only messages never dispatch into Python.
+if ENABLE_COMP_FALLBACK:
+    _TRIGGER_COND = "payload_obj and (('Wh' in payload_obj) or ('comp' in payload_obj) or ('fanfreq' in payload_obj))"
+else:
+    _TRIGGER_COND = "payload_obj and ('Wh' in payload_obj)"
+
+@mqtt_trigger(f"{STATUS_PREFIX}/+", _TRIGGER_COND)
+def faikin_state(topic=None, payload_obj=None, **kwargs):
     # topic: state/<unit>
-    try:
-        unit = topic.split("/", 1)[1]
-    except Exception:
+    _, sep, unit = topic.partition("/")
+    if not sep:
         return
 
-    dev_id = str(payload_obj.get("id") or f"faikin-{unit}")
-    _discovery(unit, dev_id, config_url=f"http://{unit}.local/")
+    now_ts = time.time()
+    st = _get(unit)
 
-    try:
-        wh = int(payload_obj["Wh"])
-    except Exception:
-        return
+    # Bind payload fields to locals once — each lookup below is a dict hash
+    p = payload_obj
+    wh_raw  = p.get("Wh")
+    dev_raw = p.get("id")
+    comp    = p.get("comp")
+    fan     = p.get("fanfreq")
 
-    ts_now = datetime.now(timezone.utc).timestamp()
-    _update_from_energy(unit, wh, ts_now)
+    dev_id = str(dev_raw or f"faikin-{unit}")
+    _discovery(unit, dev_id)
 
-# Compressor/fan handler — publishes between ticks unless within hold window.
-# Subscription is always active, but we guard on ENABLE_COMP_FALLBACK at runtime.
-@mqtt_trigger(f"{STATUS_PREFIX}/+", "payload_obj and (('comp' in payload_obj) or ('fanfreq' in payload_obj))")
-def faikin_comp_estimate(topic=None, payload_obj=None, **kwargs):
+    # --- Energy tick (pydaikin-style ΔWh / Δt) ---
+    if wh_raw is not None:
+        # JSON decodes Wh to int already; only odd payloads hit the cast
+        if type(wh_raw) is int:
+            wh = wh_raw
+        else:
+            try:
+                wh = int(wh_raw)
+            except (TypeError, ValueError):
+                wh = None
+        if wh is not None:
+            # Debounce: Faikin republishes state often, but Wh only moves every ~100 Wh.
+            # Drop unchanged repeats arriving inside the debounce window.
+            if not (DEBOUNCE_S
+                    and wh == st.last_seen_wh
+                    and now_ts - st.last_msg_ts < DEBOUNCE_S):
+                st.last_seen_wh = wh
+                st.last_msg_ts = now_ts
+                _update_from_energy(unit, wh, now_ts)
+
+    # --- Compressor fallback (optional) — publishes between ticks ---
     if not ENABLE_COMP_FALLBACK:
         return
-
-    try:
-        unit = topic.split("/", 1)[1]
-    except Exception:
+    if comp is None and fan is None:
         return
 
-    dev_id = str(payload_obj.get("id") or f"faikin-{unit}")
-    _discovery(unit, dev_id, config_url=f"http://{unit}.local/")
+    # Debounce unchanged comp repeats inside the window (same idea as the energy tick)
+    if (DEBOUNCE_S
+            and comp == st.last_seen_comp
+            and now_ts - st.last_comp_ts < DEBOUNCE_S):
+        return
+    st.last_seen_comp = comp
+    st.last_comp_ts = now_ts
 
     # Skip if we're still within the last energy-tick hold window
-    hold_until = _units.get(unit, {}).get("hold_until", 0.0)
-    now_ts = datetime.now(timezone.utc).timestamp()
-    if hold_until and now_ts <= hold_until:
+    if st.hold_until and now_ts <= st.hold_until:
         return
-
-    comp = payload_obj.get("comp")
-    fan  = payload_obj.get("fanfreq")
     try:
         comp = float(comp) if comp is not None else 0.0
         fan  = float(fan) if fan is not None else None